@@ -8,22 +8,44 @@ from aiohttp import ClientSession, TCPConnector
 from aiohttp.helpers import BasicAuth
 
 import argparse
+import csv
+import functools
+import io
+import itertools
 import logging
 import re
 import sys
 
-from subprocess import Popen, PIPE
+from collections import OrderedDict
+from subprocess import CalledProcessError, PIPE
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 __version__ = "1.2"
 
 API_HEADERS = {'Accept': 'application/json'}
+ISSUE_FIELDS = ['summary', 'status', 'issuetype', 'resolution',
+                'resolutiondate']
 LIMIT_REQUESTS = 50
+LIMIT_SEARCH_RESULTS = 100
+KEEPALIVE_TIMEOUT = 75
+DNS_CACHE_TTL = 300
+OUTPUT_BUFFER_SIZE = 1 << 20
 
 
+@functools.lru_cache(maxsize=32)
 def get_issue_regex(project):
-    """Get project issue regex."""
-    return '^.*(?P<issue_key>({project})-[0-9]+).*$'.format(project=project)
+    """Get project issue compiled regex."""
+    return re.compile(r'\b(?:{project})-\d+\b'.format(project=project))
+
+
+def get_git_issue_regex(project):
+    """Get project issue extended regex for git log grep."""
+    return '({project})-[0-9]+'.format(project=project)
 
 
 def get_issue_url(jira_url, issue_key):
@@ -37,39 +59,90 @@ def get_api_url(jira_url):
     return '{url}/rest/api/2'.format(url=jira_url)
 
 
+def get_jira_session(user=None, password=None):
+    """Get a Jira API session keeping connections alive between requests."""
+    auth = None
+    if user is not None:
+        if password is None:
+            password = ''
+        auth = BasicAuth(user, password)
+    connector = TCPConnector(limit=LIMIT_REQUESTS,
+                             keepalive_timeout=KEEPALIVE_TIMEOUT,
+                             ttl_dns_cache=DNS_CACHE_TTL)
+    return ClientSession(connector=connector, headers=API_HEADERS, auth=auth)
+
+
 def get_issues_data(issues, url, user=None, password=None):
     """Get data from a list of issues."""
     loop = asyncio.get_event_loop()
     future = asyncio.ensure_future(
-        __get_all_issues_data(issues, url, user, password))
+        __get_session_issues_data(issues, url, user, password))
     return loop.run_until_complete(future)
 
 
-async def __get_all_issues_data(issues, url, user, password):
-    issues_data = []
-    auth = None
-    if user is not None:
-        if password is None:
-            password = ''
-        auth = BasicAuth(user, password)
-    async with ClientSession(connector=TCPConnector(limit=LIMIT_REQUESTS),
-                             headers=API_HEADERS, auth=auth) as session:
-        for issue in issues:
-            issue_data = asyncio.ensure_future(
-                __get_issue_data(session, issue, url))
-            issues_data.append(issue_data)
-        return await asyncio.gather(*issues_data)
+async def __get_session_issues_data(issues, url, user, password):
+    async with get_jira_session(user, password) as session:
+        return await __get_all_issues_data(session, issues, url)
+
+
+async def __get_all_issues_data(session, issues, url):
+    chunks_data = await asyncio.gather(
+        *__get_issues_chunk_searches(session, issues, url))
+    return [issue_data
+            for chunk_data in chunks_data
+            for issue_data in chunk_data]
+
+
+def __get_issues_chunk_searches(session, issues, url):
+    """Get issue chunk search coroutines sharing a concurrency limit."""
+    semaphore = asyncio.Semaphore(LIMIT_REQUESTS)
+    return [__get_issues_chunk_data(semaphore, session,
+                                    issues[i:i + LIMIT_SEARCH_RESULTS], url)
+            for i in range(0, len(issues), LIMIT_SEARCH_RESULTS)]
+
+
+async def __get_issues_chunk_data(semaphore, session, issue_keys, url):
+    """Get data from a group of issues with a single search."""
+    logger = logging.getLogger('jira_commits_report.get_issues_data')
+    search_url = '{api_url}/search'.format(api_url=get_api_url(url))
+    search = {
+        'jql': 'key in ({keys})'.format(keys=','.join(issue_keys)),
+        'fields': ISSUE_FIELDS,
+        'maxResults': len(issue_keys),
+        'validateQuery': False
+    }
+    found_issues = {}
+    async with semaphore:
+        async with session.post(search_url, json=search) as response:
+            logger.info('Getting "%s" issues data', ','.join(issue_keys))
+            if response.status == 200:
+                search_data = await response.json(loads=json_loads)
+                found_issues = {issue_data['key']: issue_data
+                                for issue_data in search_data['issues']}
+            else:
+                logger.warn('Error %s getting "%s" issues',
+                            response.status, ','.join(issue_keys))
+
+        # Moved issues are found by their old key but returned with the new
+        # one, so keys missing from the search are requested one by one
+        for issue_key in issue_keys:
+            if issue_key not in found_issues:
+                found_issues[issue_key] = await __get_issue_data(
+                    session, issue_key, url)
+
+    return [found_issues[issue_key] for issue_key in issue_keys]
 
 
 async def __get_issue_data(session, issue_key, url):
     """Get data from an issue."""
-    logger = logging.getLogger('jira_commits_report.get_issue_data')
+    logger = logging.getLogger('jira_commits_report.get_issues_data')
     issue_url = '{api_url}/issue/{key}'.format(api_url=get_api_url(url),
                                                key=issue_key)
-    async with session.get(issue_url) as response:
+    params = {'fields': ','.join(ISSUE_FIELDS)}
+    async with session.get(issue_url, params=params) as response:
         logger.info('Getting "%s" issue data', issue_key)
         if response.status == 200:
-            issue_data = await response.json()
+            issue_data = await response.json(loads=json_loads)
         else:
             issue_data = {
                 'key': issue_key,
@@ -82,65 +155,68 @@ async def __get_issue_data(session, issue_key, url):
 
 
 def get_commits_issues(project, commit_list):
-    """Get all unrepeated issues from a commit list."""
-    issues = set()
-
-    for commit in commit_list:
-        issue_match = re.match(get_issue_regex(project),
-                               commit['comment'])
-        if issue_match:
-            issues.add(issue_match.group('issue_key'))
+    """Get all unrepeated issues from a commit list in found order."""
+    issue_regex = get_issue_regex(project)
+    issues = OrderedDict.fromkeys(
+        issue
+        for commit in commit_list
+        for issue in issue_regex.findall(commit['comment']))
 
     return list(issues)
 
 
-def write(text, file=None):
-    """Write text to specified output."""
-    if file is None:
-        print(text)
-    else:
-        with open(file, 'a') as f:
-            print(text, file=f)
-
-
-def __call_git_log(args, repo_path):
-    args.extend(['--pretty=oneline'])
+async def __call_git_log(args, repo_path, project=None):
+    args.extend(['-z', '--format=%H%x00%s'])
+    if project is not None:
+        args.extend(['--extended-regexp',
+                     '--grep={regex}'.format(
+                         regex=get_git_issue_regex(project))])
     command_args = ['git', 'log']
     command_args.extend(args)
-    p = Popen(command_args, stdout=PIPE, stderr=PIPE, cwd=repo_path)
-    raw_out, raw_err = p.communicate()
-    out = raw_out.decode()
+    p = await asyncio.create_subprocess_exec(*command_args, stdout=PIPE,
+                                             stderr=PIPE, cwd=repo_path)
+    raw_out, raw_err = await p.communicate()
     if p.returncode:
-        raise RuntimeError(
-            ('Cmd(\'git\') failed due to: exit code({code})\n'
-             '  cmdline: {cmd}\n  stderr: {out}').format(
-                code=p.returncode,
-                cmd=' '.join(command_args),
-                out=raw_err.decode()[:-1]))
-
-    log_lines = out.splitlines()
-    log_line_regex = '^(?P<commit>[^ ]+) (?P<comment>.*)$'
-    commits = [re.match(log_line_regex, line).groupdict()
-               for line in log_lines]
+        raise CalledProcessError(p.returncode, command_args,
+                                 output=raw_out, stderr=raw_err)
+
+    fields = iter(raw_out.decode().split('\x00'))
+    commits = [{'commit': commit, 'comment': comment}
+               for commit, comment in zip(fields, fields)]
 
     return commits
 
 
-def get_commits_between_dates(from_date=None, to_date=None, repo_path='.'):
+def get_commits_between_dates(from_date=None, to_date=None, repo_path='.',
+                              project=None):
     """Get all repo commits between two dates."""
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(
+        __get_commits_between_dates(from_date, to_date, repo_path, project))
+
+
+async def __get_commits_between_dates(from_date, to_date, repo_path,
+                                      project):
     args = []
     if from_date is not None:
         args.append('--since=\'{from_date}\''.format(from_date=from_date))
     if to_date is not None:
         args.append('--until=\'{to_date}\''.format(to_date=to_date))
 
-    commits = __call_git_log(args, repo_path)
+    commits = await __call_git_log(args, repo_path, project)
 
     return commits
 
 
-def get_commits_between_refs(from_ref=None, to_ref=None, repo_path='.'):
+def get_commits_between_refs(from_ref=None, to_ref=None, repo_path='.',
+                             project=None):
     """Get all repo commits between two refs."""
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(
+        __get_commits_between_refs(from_ref, to_ref, repo_path, project))
+
+
+async def __get_commits_between_refs(from_ref, to_ref, repo_path, project):
     if to_ref is None:
         to_ref = 'HEAD'
 
@@ -152,17 +228,26 @@ def get_commits_between_refs(from_ref=None, to_ref=None, repo_path='.'):
     diff_args.append(to_ref)
     args.append(''.join(diff_args))
 
-    commits = __call_git_log(args, repo_path)
+    commits = await __call_git_log(args, repo_path, project)
 
     return commits
 
 
-def sanitize(text):
-    """Sanitize a text to insert into a CSV."""
-    if text is None:
-        return None
+def write_issue_row(writer, issue, jira_url):
+    """Write an issue report row with a CSV writer."""
+    if 'error_message' in issue:
+        writer.writerow([issue['key'], 'Error', issue['error_message']])
     else:
-        return text.replace('"', '""')
+        fields = issue['fields']
+        resolution = fields['resolution']
+        writer.writerow([
+            issue['key'],
+            fields['issuetype']['name'],
+            fields['summary'],
+            fields['status']['name'],
+            resolution and resolution['name'],
+            fields['resolutiondate'],
+            get_issue_url(jira_url, issue['key'])])
 
 
 def main():
@@ -199,53 +284,69 @@ def main():
         logging_format = '[%(asctime)s] %(levelname)s - %(name)s - %(message)s'
     logging.basicConfig(stream=sys.stderr, format=logging_format,
                         level=logging.WARN - args.verbose * 10)
+
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(__main(args))
+
+
+async def __main(args):
     logger = logging.getLogger('jira_commits_report')
 
     # Get commits and write results
-    commits = []
+    project = '|'.join(args.project)
     try:
-        get_commits_function = get_commits_between_refs
+        get_commits_function = __get_commits_between_refs
         if args.type == 'date':
-            get_commits_function = get_commits_between_dates
-
-        for repo_path in args.repo_path:
-            commits.extend(get_commits_function(args.from_value, args.to_value,
-                                                repo_path))
+            get_commits_function = __get_commits_between_dates
+
+        repos_commits = await asyncio.gather(*[
+            get_commits_function(args.from_value, args.to_value,
+                                 repo_path, project)
+            for repo_path in args.repo_path])
+        commits = list(itertools.chain.from_iterable(repos_commits))
+    except CalledProcessError as e:
+        message = ('Cmd(\'git\') failed due to: exit code({code})\n'
+                   '  cmdline: {cmd}\n  stderr: {err}')
+        print(message.format(code=e.returncode, cmd=' '.join(e.cmd),
+                             err=e.stderr.decode().rstrip('\n')),
+              file=sys.stderr)
+        return 1
     except Exception as e:
         print(e, file=sys.stderr)
         return 1
 
-    issue_keys = get_commits_issues('|'.join(args.project), commits)
+    issue_keys = get_commits_issues(project, commits)
     logger.info('Found "%s" issues', len(issue_keys))
-    write(('"key","issue_type","summary","status",'
-           '"resolution","resolution_date","url"'),
-          file=args.file)
-
-    issues = get_issues_data(issue_keys, url=args.jira_server,
-                             user=args.jira_user, password=args.jira_password)
-    for issue in issues:
-        if 'error_message' in issue:
-            write('"{key}","Error","{error_text}"'.format(
-                  key=sanitize(issue['key']),
-                  error_text=sanitize(issue['error_message'])),
-                  file=args.file)
+    if args.file is not None:
+        out = open(args.file, 'w', newline='', buffering=OUTPUT_BUFFER_SIZE)
+    elif hasattr(sys.stdout, 'buffer'):
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding=sys.stdout.encoding,
+                               errors=sys.stdout.errors, newline='',
+                               write_through=False)
+    else:
+        out = sys.stdout
+
+    try:
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(['key', 'issue_type', 'summary', 'status',
+                         'resolution', 'resolution_date', 'url'])
+
+        async with get_jira_session(args.jira_user,
+                                    args.jira_password) as session:
+            for chunk_data in asyncio.as_completed(__get_issues_chunk_searches(
+                    session, issue_keys, args.jira_server)):
+                for issue in await chunk_data:
+                    write_issue_row(writer, issue, args.jira_server)
+                    logger.info('Issue "%s" data added to report',
+                                issue['key'])
+    finally:
+        if args.file is not None:
+            out.close()
+        elif out is not sys.stdout:
+            out.flush()
+            out.detach()
         else:
-            write(('"{key}","{issue_type}","{summary}","{status}",'
-                   '"{resolution}","{resolution_date}","{url}"').
-                  format(
-                      key=sanitize(issue['key']),
-                      issue_type=sanitize(
-                          issue['fields']['issuetype']['name']),
-                      summary=sanitize(issue['fields']['summary']),
-                      status=sanitize(issue['fields']['status']['name']),
-                      resolution=sanitize(
-                          None if issue['fields']['resolution'] is None
-                          else issue['fields']['resolution']['name']),
-                      resolution_date=sanitize(
-                          issue['fields']['resolutiondate']),
-                      url=get_issue_url(args.jira_server, issue['key'])),
-                  file=args.file)
-        logger.info('Issue "%s" data added to report', issue['key'])
+            out.flush()
 
     return 0
 
@@ -1,13 +1,143 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import csv
+import io
 import unittest
 
 import jira_commits_report as jcr
 
 class ReportCreationTest(unittest.TestCase):
-    def testSanitize(self):
-        field = "Use ""this"""
+    def testGetCommitsIssues(self):
+        commits = [{'commit': '1', 'comment': 'PROJ-9 Fix PROJ-22 and OTHER-3'},
+                   {'commit': '2', 'comment': 'Merge PROJ-9'},
+                   {'commit': '3', 'comment': 'XPROJ-4 is not an issue'}]
 
-        self.assertEqual("Use """"this""""", jcr.sanitize(field))
+        self.assertEqual(['PROJ-9', 'PROJ-22'],
+                         jcr.get_commits_issues('PROJ', commits))
+
+    def writeIssueRow(self, issue):
+        out = io.StringIO(newline='')
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        jcr.write_issue_row(writer, issue, 'http://jira')
+        return out.getvalue()
+
+    def testWriteIssueRow(self):
+        issue = {'key': 'PROJ-1',
+                 'fields': {'issuetype': {'name': 'Bug'},
+                            'summary': 'Use "this",\nnot that',
+                            'status': {'name': 'Done'},
+                            'resolution': {'name': 'Fixed'},
+                            'resolutiondate': '2017-10-21'}}
+
+        self.assertEqual(('"PROJ-1","Bug","Use ""this"",\nnot that","Done",'
+                          '"Fixed","2017-10-21","http://jira/browse/PROJ-1"\n'),
+                         self.writeIssueRow(issue))
+
+    def testWriteUnresolvedIssueRow(self):
+        issue = {'key': 'PROJ-2',
+                 'fields': {'issuetype': {'name': 'Task'},
+                            'summary': 'Pending',
+                            'status': {'name': 'Open'},
+                            'resolution': None,
+                            'resolutiondate': None}}
+
+        self.assertEqual(('"PROJ-2","Task","Pending","Open","","",'
+                          '"http://jira/browse/PROJ-2"\n'),
+                         self.writeIssueRow(issue))
+
+    def testWriteErrorIssueRow(self):
+        issue = {'key': 'PROJ-3', 'error_message': 'Errors getting issue data'}
+
+        self.assertEqual('"PROJ-3","Error","Errors getting issue data"\n',
+                         self.writeIssueRow(issue))
+
+
+class StubResponse(object):
+    def __init__(self, status, data=None):
+        self.status = status
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def json(self, loads=None):
+        return self.data
+
+
+class StubSession(object):
+    """Jira session answering searches and issue requests from a dict."""
+
+    def __init__(self, issues, search_status=200):
+        self.issues = issues
+        self.search_status = search_status
+        self.searches = []
+        self.gets = []
+
+    def post(self, url, json=None):
+        keys = json['jql'][len('key in ('):-1].split(',')
+        self.searches.append(keys)
+        found = [self.issues[key] for key in keys
+                 if self.issues.get(key, {}).get('key') == key]
+        return StubResponse(self.search_status, {'issues': found})
+
+    def get(self, url, params=None):
+        key = url.rsplit('/', 1)[-1]
+        self.gets.append(key)
+        if key in self.issues:
+            return StubResponse(200, self.issues[key])
+        return StubResponse(404)
+
+
+class IssuesDataTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def getIssuesData(self, session, issue_keys):
+        get_all_issues_data = getattr(jcr, '__get_all_issues_data')
+        return self.loop.run_until_complete(
+            get_all_issues_data(session, issue_keys, 'http://jira'))
+
+    def testFoundMovedAndMissingIssues(self):
+        session = StubSession({'PROJ-1': {'key': 'PROJ-1'},
+                               'OLD-1': {'key': 'NEW-7'}})
+
+        issues = self.getIssuesData(session, ['PROJ-1', 'OLD-1', 'PROJ-2'])
+
+        self.assertEqual([['PROJ-1', 'OLD-1', 'PROJ-2']], session.searches)
+        self.assertEqual(['OLD-1', 'PROJ-2'], session.gets)
+        self.assertEqual({'key': 'PROJ-1'}, issues[0])
+        self.assertEqual({'key': 'NEW-7'}, issues[1])
+        self.assertEqual('PROJ-2', issues[2]['key'])
+        self.assertIn('error_message', issues[2])
+
+    def testSearchError(self):
+        session = StubSession({'PROJ-1': {'key': 'PROJ-1'}},
+                              search_status=500)
+
+        issues = self.getIssuesData(session, ['PROJ-1', 'PROJ-2'])
+
+        self.assertEqual(['PROJ-1', 'PROJ-2'], session.gets)
+        self.assertEqual({'key': 'PROJ-1'}, issues[0])
+        self.assertIn('error_message', issues[1])
+
+    def testSearchChunks(self):
+        issue_keys = ['PROJ-{}'.format(i)
+                      for i in range(jcr.LIMIT_SEARCH_RESULTS + 1)]
+        session = StubSession({key: {'key': key} for key in issue_keys})
+
+        issues = self.getIssuesData(session, issue_keys)
+
+        self.assertEqual([issue_keys[:-1], issue_keys[-1:]],
+                         session.searches)
+        self.assertEqual([], session.gets)
+        self.assertEqual(issue_keys, [issue['key'] for issue in issues])
 
 
 if __name__ == '__main__':